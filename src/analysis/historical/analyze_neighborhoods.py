@@ -1,6 +1,6 @@
 import json
 from collections import defaultdict, Counter
-from datetime import datetime, timedelta, UTC
+from datetime import datetime, timedelta
 from pathlib import Path
 
 from tqdm import tqdm
@@ -8,10 +8,11 @@ from tqdm import tqdm
 from analysis.analysis_utils import parse_archived_headers
 from analysis.header_utils import HeadersEncoder, HeadersDecoder
 from analysis.post_processing.extract_script_metadata import METADATA_TABLE_NAME as SCRIPTS_TABLE_NAME
-from configs.analysis import INTERNET_ARCHIVE_END_URL_REGEX, MEMENTO_HEADER, INTERNET_ARCHIVE_SOURCE_HEADER
-from configs.crawling import INTERNET_ARCHIVE_TIMESTAMP_FORMAT, TIMESTAMPS
-from configs.database import get_database_cursor
-from configs.utils import join_with_json_path, get_tranco_data
+from configs.analysis import INTERNET_ARCHIVE_END_URL_REGEX, MEMENTO_HEADER, INTERNET_ARCHIVE_SOURCE_HEADER, \
+    ARCHIVED_RELEVANT_HEADER_KEYS
+from configs.crawling import TIMESTAMPS
+from configs.database import get_database_cursor, select_json_keys
+from configs.utils import join_with_json_path, get_tranco_data, parse_archive_datetime
 from data_collection.collect_archive_neighborhoods import CANDIDATES_TABLE_NAME, TABLE_NAME as NEIGHBORHOODS_TABLE_NAME
 from data_collection.collect_contributors import METADATA_TABLE_NAME as CONTRIBUTORS_TABLE_NAME
 
@@ -26,8 +27,7 @@ def get_neighbors(n: int = 10):
             WHERE error IS NULL
         """)
         for tid, timestamp, candidates in cursor.fetchall():
-            neighbors[tid, timestamp] = \
-                [datetime.strptime(ts, INTERNET_ARCHIVE_TIMESTAMP_FORMAT).replace(tzinfo=UTC) for ts in candidates[:n]]
+            neighbors[tid, timestamp] = [parse_archive_datetime(ts) for ts in candidates[:n]]
 
     return neighbors
 
@@ -39,14 +39,16 @@ def build_neighborhoods(targets: list[tuple[int, str, str]], n: int = 10) -> Non
     with get_database_cursor() as cursor:
         cursor.execute(f"""
             SELECT tranco_id, timestamp,
-                   (headers->>%s)::TIMESTAMPTZ, headers, substring(end_url FROM %s), status_code, contributor,
+                   (headers->>%s)::TIMESTAMPTZ, {select_json_keys('headers', ARCHIVED_RELEVANT_HEADER_KEYS)},
+                   substring(end_url FROM %s), status_code,
+                   contributor,
                    relevant_sources, hosts, sites, disconnect_trackers, easyprivacy_trackers
             FROM {NEIGHBORHOODS_TABLE_NAME}
             JOIN {SCRIPTS_TABLE_NAME} USING (content_hash)
             JOIN {CONTRIBUTORS_TABLE_NAME} ON SPLIT_PART(headers->>%s, '/', 1)=source
             WHERE (headers->>%s)::TIMESTAMPTZ IS NOT NULL
-        """, (MEMENTO_HEADER.lower(), INTERNET_ARCHIVE_END_URL_REGEX, INTERNET_ARCHIVE_SOURCE_HEADER.lower(),
-              MEMENTO_HEADER.lower()))
+        """, (MEMENTO_HEADER.lower(), INTERNET_ARCHIVE_END_URL_REGEX,
+              INTERNET_ARCHIVE_SOURCE_HEADER.lower(), MEMENTO_HEADER.lower()))
         for tid, timestamp, archived_timestamp, headers, *data in cursor.fetchall():
             archive_data[tid, timestamp] = (archived_timestamp, parse_archived_headers(headers), *data)
 
@@ -11,12 +11,12 @@ from analysis.analysis_utils import parse_archived_headers, parse_site
 from analysis.header_utils import Headers, parse_origin, normalize_headers, classify_headers
 from analysis.post_processing.extract_script_metadata import METADATA_TABLE_NAME
 from configs.analysis import RELEVANT_HEADERS, INTERNET_ARCHIVE_END_URL_REGEX, MEMENTO_HEADER, \
-    SECURITY_MECHANISM_HEADERS
+    SECURITY_MECHANISM_HEADERS, RELEVANT_HEADER_KEYS, ARCHIVED_RELEVANT_HEADER_KEYS
 from configs.crawling import ARCHIVE_IT_USER_AGENT
-from configs.database import get_database_cursor, STORAGE
+from configs.database import get_database_cursor, select_json_keys, STORAGE
 from configs.utils import get_tranco_data, join_with_json_path
 from data_collection.collect_live_data import TABLE_NAME as LIVE_TABLE_NAME
-from data_collection.crawling import crawl, CrawlingException
+from data_collection.crawling import crawl, make_session, CrawlingException
 
 TIMESTAMP = datetime(2023, 9, 1, 12, tzinfo=UTC)
 ARCHIVE_TABLE_NAME = 'HISTORICAL_DATA_FOR_COMPARISON'
@@ -57,8 +57,10 @@ def analyze_headers(targets: list[tuple[int, str, str]]) -> None:
     analysis_data = {}
     with get_database_cursor() as cursor:
         cursor.execute(f"""
-            SELECT tranco_id, l.end_url, l.status_code, l.headers, l.content_hash,
-                   substring(a.end_url FROM %s), a.status_code, a.headers, a.content_hash, (a.headers->>%s)::TIMESTAMPTZ
+            SELECT tranco_id, l.end_url, l.status_code, {select_json_keys('l.headers', RELEVANT_HEADER_KEYS)},
+                   l.content_hash, substring(a.end_url FROM %s), a.status_code,
+                   {select_json_keys('a.headers', ARCHIVED_RELEVANT_HEADER_KEYS)}, a.content_hash,
+                   (a.headers->>%s)::TIMESTAMPTZ
             FROM {LIVE_TABLE_NAME} l JOIN {ARCHIVE_TABLE_NAME} a USING (tranco_id, status_code, timestamp)
             WHERE l.status_code IS NOT NULL AND a.headers->>%s IS NOT NULL AND timestamp=%s
         """, (INTERNET_ARCHIVE_END_URL_REGEX, MEMENTO_HEADER.lower(), MEMENTO_HEADER.lower(), TIMESTAMP))
@@ -125,11 +127,16 @@ def analyze_user_agent_sniffing(disagreement_file: Path) -> None:
     with open(disagreement_file) as file:
         disagreement = json.load(file)
 
+    # keep-alive sessions per user agent, such that cookies set for one user agent never leak into the other
+    chrome_session, archive_org_session = make_session(), make_session()
     result = defaultdict(set)
     for url in tqdm(disagreement['DIFFERENT']):
+        # start both crawls without cookies, such that only the user agent differs between them
+        chrome_session.cookies.clear()
+        archive_org_session.cookies.clear()
         try:
-            chrome = crawl(url, store_content=False)
-            archive_org = crawl(url, user_agent=ARCHIVE_IT_USER_AGENT, store_content=False)
+            chrome = crawl(url, session=chrome_session, store_content=False)
+            archive_org = crawl(url, user_agent=ARCHIVE_IT_USER_AGENT, session=archive_org_session, store_content=False)
         except CrawlingException:
             result['ERROR'].add(url)
             continue
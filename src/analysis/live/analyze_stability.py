@@ -9,8 +9,8 @@ from analysis.analysis_utils import timedelta_to_days, parse_site
 from analysis.header_utils import Headers, Origin, parse_origin, normalize_headers, classify_headers
 from analysis.live.stability_enums import Status
 from analysis.post_processing.extract_script_metadata import METADATA_TABLE_NAME
-from configs.analysis import RELEVANT_HEADERS, MEMENTO_HEADER
-from configs.database import get_database_cursor, get_min_timestamp, get_max_timestamp
+from configs.analysis import RELEVANT_HEADERS, MEMENTO_HEADER, RELEVANT_HEADER_KEYS
+from configs.database import get_database_cursor, get_min_timestamp, get_max_timestamp, select_json_keys
 from configs.utils import join_with_json_path, get_tranco_data, date_range
 from data_collection.collect_live_data import TABLE_NAME as LIVE_TABLE_NAME
 
@@ -25,7 +25,7 @@ def analyze_live_headers(targets: list[tuple[int, str, str]],
     live_data = {}
     with get_database_cursor() as cursor:
         cursor.execute(f"""
-            SELECT tranco_id, timestamp, headers, end_url
+            SELECT tranco_id, timestamp, {select_json_keys('headers', RELEVANT_HEADER_KEYS)}, end_url
             FROM {LIVE_TABLE_NAME}
             WHERE status_code=200 AND timestamp BETWEEN %s AND %s
         """, (start, end))
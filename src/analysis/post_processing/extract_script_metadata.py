@@ -16,9 +16,10 @@ from configs.database import STORAGE, get_database_cursor
 from data_collection.collect_archive_data import TABLE_NAME as ARCHIVE_TABLE_NAME
 from data_collection.collect_archive_neighborhoods import TABLE_NAME as NEIGHBORHOODS_TABLE_NAME
 from data_collection.collect_live_data import TABLE_NAME as LIVE_TABLE_NAME
-from data_collection.crawling import partition_jobs
+from data_collection.crawling import chunk_jobs
 
 WORKERS = 128
+CHUNK_SIZE = 64
 
 METADATA_TABLE_NAME = 'HTML_SCRIPT_METADATA'
 
@@ -78,10 +79,11 @@ def worker(jobs: list[AnalysisJob]) -> None:
 
             hosts = {parse_hostname(source) for source in relevant_sources}
             sites = {parse_site(source) for source in relevant_sources}
+            first_party_origin = parse_origin(end_url)
             disconnect_trackers = {source for source in relevant_sources
-                                   if is_disconnect_tracker(source, parse_origin(end_url))}
+                                   if is_disconnect_tracker(source, first_party_origin)}
             easyprivacy_trackers = {source for source in relevant_sources
-                                    if is_easyprivacy_tracker(source, parse_origin(end_url))}
+                                    if is_easyprivacy_tracker(source, first_party_origin)}
 
             cursor.execute(f"""
                 INSERT INTO {METADATA_TABLE_NAME}
@@ -107,9 +109,10 @@ def prepare_jobs(table_name: str) -> list[AnalysisJob]:
 
 
 def run_jobs(jobs: list[AnalysisJob]) -> None:
-    """Execute the provided AnalysisJobs using multiprocessing."""
+    """Execute the provided AnalysisJobs using multiprocessing, handing out chunks of `CHUNK_SIZE` jobs on demand."""
     with Pool(WORKERS) as pool:
-        pool.map(worker, partition_jobs(jobs, WORKERS))
+        for _ in pool.imap_unordered(worker, chunk_jobs(jobs, CHUNK_SIZE)):
+            pass
 
 
 def main():
@@ -27,5 +27,9 @@ INTERNET_ARCHIVE_SOURCE_HEADER = 'X-Archive-Src'
 INTERNET_ARCHIVE_HEADER_PREFIX = 'X-Archive-Orig-'
 INTERNET_ARCHIVE_END_URL_REGEX = r'^(?:[^\/]*\/){5}(.*)'
 
+# lowercase names used to select the relevant (archived) headers within the database
+RELEVANT_HEADER_KEYS = [header.lower() for header in RELEVANT_HEADERS]
+ARCHIVED_RELEVANT_HEADER_KEYS = [f"{INTERNET_ARCHIVE_HEADER_PREFIX}{header}".lower() for header in RELEVANT_HEADERS]
+
 MEMENTO_HEADER = 'Memento-Datetime'
 MEMENTO_HEADER_FORMAT = '%a, %d %b %Y %H:%M:%S %Z'
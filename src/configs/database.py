@@ -1,12 +1,13 @@
-import json
-from collections.abc import Generator
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Any
 
+import orjson
 from psycopg2 import connect
-from psycopg2.extensions import connection as connection_type, cursor as cursor_type
+from psycopg2.extensions import connection as connection_type, cursor as cursor_type, adapt
 from psycopg2.extras import register_default_jsonb
 from requests.structures import CaseInsensitiveDict
 
@@ -21,17 +22,20 @@ DB_NAME = '<DB_NAME>'
 STORAGE = Path('<PATH/TO/DATA/DIRECTORY/>')
 
 
-def json_loads_ci(*args: Any, **kwargs: Any) -> Any:
+def json_loads_ci(data: str | bytes) -> Any:
     """Deserialize JSON data, transforming into a `CaseInsensitiveDict` if applicable."""
-    deserialized_object = json.loads(*args, **kwargs)
-    return CaseInsensitiveDict(deserialized_object) if isinstance(deserialized_object, dict) else deserialized_object
+    deserialized_object = orjson.loads(data)
+    return CaseInsensitiveDict(deserialized_object) if type(deserialized_object) is dict else deserialized_object
+
+
+# JSONB has a fixed type oid, so the typecaster can be registered once for all connections of this process
+register_default_jsonb(globally=True, loads=json_loads_ci)
 
 
 def get_database_connection(autocommit: bool = False) -> connection_type:
     """Establish a connection to the database and return the connection object."""
     connection = connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PWD)
     connection.autocommit = autocommit
-    register_default_jsonb(connection, loads=json_loads_ci)
     return connection
 
 
@@ -50,6 +54,33 @@ def get_database_cursor(autocommit: bool = False) -> Generator[cursor_type, None
         connection.close()
 
 
+def create_indexes(table_name: str, columns: Iterable[str], workers: int = 4) -> None:
+    """Create all missing single-column indexes on `table_name`, building up to `workers` indexes in parallel.
+
+    Every index is built in a separate connection. Unlike `CREATE INDEX CONCURRENTLY`, plain index builds on the same
+    table do not conflict with each other and can therefore actually run in parallel.
+    """
+
+    def create_index(column: str) -> None:
+        with get_database_cursor() as cursor:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_{column}_idx ON {table_name} ({column})")
+
+    with ThreadPoolExecutor(workers) as executor:
+        for _ in executor.map(create_index, columns):
+            pass
+
+
+def select_json_keys(column: str, keys: Iterable[str]) -> str:
+    """Return an SQL expression that reduces the JSONB object in `column` to the (lowercase) `keys`.
+
+    Keys are matched case-insensitively, such that only the relevant (usually tiny) part of e.g. a `headers` object is
+    transferred to and deserialized by the client.
+    """
+    keys_array = adapt(list(keys)).getquoted().decode()
+    return (f"COALESCE((SELECT JSONB_OBJECT_AGG(key, value) FROM JSONB_EACH({column}) "
+            f"WHERE LOWER(key)=ANY({keys_array})), '{{}}')")
+
+
 def get_min_timestamp(table_name: str) -> datetime:
     """Query the database for the `minimum timestamp` in `table_name`."""
     with get_database_cursor() as cursor:
@@ -1,21 +1,19 @@
 import json
 from itertools import chain
 
-from configs.utils import PROJECT_ROOT
+from configs.utils import FILES_DIR, dump_json
 
 
 def create_trackers_json() -> None:
     """Parse Disconnect list and create tracking.json containing the set of tracking domains."""
-    with open(PROJECT_ROOT.joinpath('src', 'configs', 'files', 'disconnect_entities.json')) as file:
+    with open(FILES_DIR / 'disconnect_entities.json') as file:
         entities = json.load(file)
 
     trackers = set()
-    for entity_name, entity_info in entities['entities'].items():
-        for domain in chain(*entity_info.values()):
-            trackers.add(domain)
+    for entity_info in entities['entities'].values():
+        trackers.update(chain.from_iterable(entity_info.values()))
 
-    with open(PROJECT_ROOT.joinpath('src', 'configs', 'files', 'disconnect_trackers.json'), 'w') as file:
-        json.dump(sorted(trackers), file, indent=2)
+    dump_json(sorted(trackers), FILES_DIR / 'disconnect_trackers.json')
 
 
 def main():
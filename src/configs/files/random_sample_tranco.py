@@ -1,4 +1,5 @@
 import random
+from operator import itemgetter
 
 from configs.utils import get_absolute_tranco_file_path
 
@@ -12,13 +13,18 @@ def sample(buckets: int = 10, domains_per_bucket: int = 2000) -> None:
     with open(get_absolute_tranco_file_path()) as file:
         lines = file.readlines()
 
+    # Sample line indices instead of slicing copies of each bucket; `random.sample` only depends on the population size,
+    # so the drawn sample is identical to sampling from the bucket slices for the same seed.
     sampled_lines = []
     bucket_size = len(lines) // buckets
     for i in range(buckets):
-        sampled_lines += random.sample(lines[bucket_size * i:bucket_size * (i + 1)], domains_per_bucket)
+        indices = random.sample(range(bucket_size * i, bucket_size * (i + 1)), domains_per_bucket)
+        sampled_lines += [lines[index] for index in indices]
 
     with open(get_absolute_tranco_file_path().parent.joinpath(f"tranco_random_sample.{SEED}.csv"), 'w') as file:
-        file.writelines(sorted(sampled_lines, key=lambda data: int(data.split(',')[0])))
+        ranked_lines = [(int(line.split(',', 1)[0]), line) for line in sampled_lines]
+        ranked_lines.sort(key=itemgetter(0))
+        file.writelines(line for _, line in ranked_lines)
 
 
 def main():
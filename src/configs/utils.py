@@ -1,10 +1,13 @@
-import json
+import csv
+from calendar import timegm
 from collections.abc import Generator
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, UTC
 from itertools import islice
 from math import inf
 from pathlib import Path
+from typing import Any
 
+import orjson
 from adblockparser import AdblockRules
 
 from configs.crawling import NUMBER_URLS, URL_PREFIX
@@ -12,15 +15,19 @@ from configs.crawling import NUMBER_URLS, URL_PREFIX
 PROJECT_ROOT = Path('<AUTOMATICALLY-REPLACED-DURING-INSTALL>')
 INSTALLED_PROJECT_ROOT = Path(__file__).parents[1].resolve()
 
+JSON_DIR = PROJECT_ROOT.joinpath('results', 'json')
+PLOTS_DIR = PROJECT_ROOT.joinpath('results', 'plots')
+FILES_DIR = PROJECT_ROOT.joinpath('src', 'configs', 'files')
+
 
 def join_with_json_path(filename: str) -> Path:
     """Return absolute path to the specified `filename` in the results/json directory."""
-    return PROJECT_ROOT.joinpath('results', 'json', filename)
+    return JSON_DIR / filename
 
 
 def join_with_plots_path(filename: str) -> Path:
     """Return absolute path to the specified `filename` in the results/plots directory."""
-    return PROJECT_ROOT.joinpath('results', 'plots', filename)
+    return PLOTS_DIR / filename
 
 
 def json_to_plots_path(file_path: Path, extension: str = '.png') -> Path:
@@ -28,20 +35,28 @@ def json_to_plots_path(file_path: Path, extension: str = '.png') -> Path:
     return join_with_plots_path(file_path.with_suffix(extension).name)
 
 
+def dump_json(obj: Any, file_path: Path) -> None:
+    """Serialize `obj` as (2-space indented) JSON into the file at `file_path`."""
+    file_path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+
+
 def get_absolute_tranco_file_path(filename: str = 'tranco_W9JG9.csv') -> Path:
     """Return absolute path to the Tranco file."""
-    return PROJECT_ROOT.joinpath('src', 'configs', 'files', filename)
+    return FILES_DIR / filename
+
+
+def iter_tranco_data(tranco_file: Path = get_absolute_tranco_file_path(),
+                     n: int = NUMBER_URLS) -> Generator[tuple[int, str, str], None, None]:
+    """Lazily yield `n` domains from the given `tranco_file` expanded into full urls by prepending `URL_PREFIX`."""
+    with open(tranco_file, newline='') as file:
+        for tranco_id, domain in islice(csv.reader(file), n):
+            yield int(tranco_id), domain, f"{URL_PREFIX}{domain}/"
 
 
 def get_tranco_data(tranco_file: Path = get_absolute_tranco_file_path(),
                     n: int = NUMBER_URLS) -> list[tuple[int, str, str]]:
     """Read `n` domains from the given `tranco_file` and expand them into full urls by prepending `URL_PREFIX`."""
-    data = []
-    with open(tranco_file) as file:
-        for line in islice(file, n):
-            tranco_id, domain = line.strip().split(',')
-            data.append((int(tranco_id), domain, f"{URL_PREFIX}{domain}/"))
-    return data
+    return list(iter_tranco_data(tranco_file, n))
 
 
 def date_range(start: datetime | date, end: datetime | date, n: int = inf) -> Generator[datetime | date, None, None]:
@@ -57,15 +72,26 @@ def compute_tolerance_window(timestamp: datetime, tolerance: timedelta | None =
         return datetime.min, datetime.max
 
 
-def get_disconnect_tracking_domains() -> set[str]:
-    """Return the set of tracking domains based on the Disconnect List."""
-    with open(PROJECT_ROOT.joinpath('src', 'configs', 'files', 'disconnect_trackers.json')) as file:
-        return set(json.load(file))
+def parse_archive_datetime(value: str) -> datetime:
+    """Convert a (14-digit) Internet Archive timestamp into a UTC datetime without the overhead of `strptime`."""
+    return datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                    int(value[8:10]), int(value[10:12]), int(value[12:14]), tzinfo=UTC)
+
+
+def parse_archive_timestamp(value: str) -> int:
+    """Convert a (14-digit) Internet Archive timestamp into seconds since the epoch, interpreting it as UTC."""
+    return timegm((int(value[:4]), int(value[4:6]), int(value[6:8]),
+                   int(value[8:10]), int(value[10:12]), int(value[12:14])))
+
+
+def get_disconnect_tracking_domains() -> frozenset[str]:
+    """Return the (immutable) set of tracking domains based on the Disconnect List."""
+    return frozenset(orjson.loads(FILES_DIR.joinpath('disconnect_trackers.json').read_bytes()))
 
 
 def get_easyprivacy_rules(supported_options: list[str], skip_unsupported_rules: bool) -> AdblockRules:
     """Parse the EasyPrivacy rules and provide classifier."""
-    with open(PROJECT_ROOT.joinpath('src', 'configs', 'files', 'easyprivacy.txt')) as file:
+    with open(FILES_DIR / 'easyprivacy.txt') as file:
         return AdblockRules(
             file.read().splitlines(),
             supported_options=supported_options,
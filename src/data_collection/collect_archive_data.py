@@ -1,17 +1,20 @@
+from collections.abc import Iterable, Iterator
 from datetime import datetime
+from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
-from time import sleep
 from typing import NamedTuple
 
-import requests
-
 from configs.crawling import NUMBER_URLS, INTERNET_ARCHIVE_URL, INTERNET_ARCHIVE_TIMESTAMP_FORMAT, TIMESTAMPS
-from configs.database import get_database_cursor
-from configs.utils import get_absolute_tranco_file_path, get_tranco_data
-from data_collection.crawling import setup, reset_failed_archive_crawls, partition_jobs, CrawlingException, crawl
+from configs.utils import get_absolute_tranco_file_path, iter_tranco_data
+from data_collection.crawling import setup, reset_failed_archive_crawls, chunk_jobs, shuffle_jobs, RowBatcher, \
+    RateLimiter, init_worker, get_worker_cursor, get_worker_session, wait_for_rate_limit, CrawlingException, crawl, \
+    BATCH_SIZE, RESPONSE_COLUMNS, ERROR_COLUMNS
 
 WORKERS = 8
+CHUNK_SIZE = 4 * BATCH_SIZE
+REQUEST_RATE = 5 * WORKERS
+REQUEST_BURST = WORKERS
 
 TABLE_NAME = 'HISTORICAL_DATA'
 
@@ -26,46 +29,58 @@ class ArchiveJob(NamedTuple):
 
 
 def worker(jobs: list[ArchiveJob], table_name: str = TABLE_NAME) -> None:
-    """Crawl all provided `urls` and store the responses in the database."""
-    with get_database_cursor(autocommit=True) as cursor:
-        session = requests.Session()
-        for timestamp, tranco_id, domain, url, proxies in jobs:
-            sleep(0.2)
-            try:
-                response = crawl(url, proxies=proxies, session=session)
-                cursor.execute(f"""
-                    INSERT INTO {table_name}
-                    (tranco_id, domain, timestamp, start_url, end_url, status_code, headers, content_hash, response_time)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (tranco_id, domain, timestamp, url, *response.serialized_data))
-            except CrawlingException as error:
-                cursor.execute(f"""
-                    INSERT INTO {table_name}
-                    (tranco_id, domain, timestamp, start_url, headers)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (tranco_id, domain, timestamp, url, error.to_json()))
+    """Crawl all provided `urls` and store the responses in the database, committing once per `BATCH_SIZE` jobs."""
+    with get_worker_cursor() as cursor:
+        session = get_worker_session()
+        batcher = RowBatcher(cursor, BATCH_SIZE)
+        try:
+            for timestamp, tranco_id, domain, url, proxies in jobs:
+                wait_for_rate_limit()
+                try:
+                    response = crawl(url, proxies=proxies, session=session)
+                    batcher.add(table_name, RESPONSE_COLUMNS,
+                                (tranco_id, domain, timestamp, url, *response.serialized_data))
+                except CrawlingException as error:
+                    batcher.add(table_name, ERROR_COLUMNS, (tranco_id, domain, timestamp, url, error.to_json()))
+        finally:
+            batcher.flush()
 
 
 def prepare_jobs(tranco_file: Path = get_absolute_tranco_file_path(),
                  timestamps: list[datetime] = TIMESTAMPS,
                  proxies: dict[str, str] | None = None,
-                 n: int = NUMBER_URLS) -> list[ArchiveJob]:
-    """Generate ArchiveJob list for Tranco file, timestamps, and max domains per timestamp."""
+                 n: int = NUMBER_URLS) -> Iterator[ArchiveJob]:
+    """Lazily generate ArchiveJobs for Tranco file, timestamps, and max domains per timestamp."""
     worked_jobs = reset_failed_archive_crawls(TABLE_NAME)
-    timestamp_strings = [timestamp.strftime(INTERNET_ARCHIVE_TIMESTAMP_FORMAT) for timestamp in timestamps]
-
-    return [
-        ArchiveJob(timestamp, tranco_id, domain, INTERNET_ARCHIVE_URL.format(timestamp=timestamp_str, url=url), proxies)
-        for tranco_id, domain, url in get_tranco_data(tranco_file, n)
-        for timestamp, timestamp_str in zip(timestamps, timestamp_strings)
-        if tranco_id not in worked_jobs[timestamp]
-    ]
-
-
-def run_jobs(jobs: list[ArchiveJob]) -> None:
-    """Execute the provided crawl jobs using multiprocessing."""
-    with Pool(WORKERS) as pool:
-        pool.map(worker, partition_jobs(jobs, WORKERS))
+    # Split the archive URL template around the archived url once per timestamp instead of formatting it per job
+    targets = []
+    for timestamp in timestamps:
+        timestamp_str = timestamp.strftime(INTERNET_ARCHIVE_TIMESTAMP_FORMAT)
+        url_prefix, url_suffix = INTERNET_ARCHIVE_URL.format(timestamp=timestamp_str, url='\0').split('\0')
+        targets.append((timestamp, url_prefix, url_suffix, worked_jobs[timestamp]))
+    # Domains that have already been crawled for all timestamps can be skipped with a single lookup
+    completed = set.intersection(*(worked for *_, worked in targets)) if targets else set()
+
+    return (
+        ArchiveJob(timestamp, tranco_id, domain, f"{url_prefix}{url}{url_suffix}", proxies)
+        for tranco_id, domain, url in iter_tranco_data(tranco_file, n)
+        if tranco_id not in completed
+        for timestamp, url_prefix, url_suffix, worked in targets
+        if tranco_id not in worked
+    )
+
+
+def run_jobs(jobs: Iterable[ArchiveJob], table_name: str = TABLE_NAME) -> None:
+    """Execute the provided crawl jobs using multiprocessing, dispatching them in chunks of `CHUNK_SIZE` jobs.
+
+    Jobs are shuffled first, such that domains are not crawled in the order of their rank. Chunks are handed out on
+    demand, such that workers that finish early pull more work instead of idling. Every worker process keeps a single
+    database connection and HTTP session for all its chunks; all workers share one rate limit.
+    """
+    chunks = chunk_jobs(shuffle_jobs(jobs), CHUNK_SIZE)
+    with Pool(WORKERS, initializer=init_worker, initargs=(RateLimiter(REQUEST_RATE, REQUEST_BURST),)) as pool:
+        for _ in pool.imap_unordered(partial(worker, table_name=table_name), chunks):
+            pass
 
 
 def main():
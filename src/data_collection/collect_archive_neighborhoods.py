@@ -1,30 +1,34 @@
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from datetime import datetime, timedelta, UTC
-from functools import partial
-from heapq import nsmallest
-from itertools import chain
+from datetime import datetime, timedelta
 from multiprocessing import Pool
 from pathlib import Path
-from time import sleep
 from typing import NamedTuple, Generator
 
-import requests
 from psycopg2.extras import Json
-from requests import Session, JSONDecodeError
+from requests import Session
 
 from configs.crawling import NUMBER_URLS, INTERNET_ARCHIVE_TIMESTAMP_FORMAT, TIMESTAMPS, INTERNET_ARCHIVE_URL
-from configs.database import get_database_cursor
-from configs.utils import get_absolute_tranco_file_path, get_tranco_data, compute_tolerance_window
-from data_collection.collect_archive_data import WORKERS, ArchiveJob, worker as archive_worker
-from data_collection.crawling import setup, reset_failed_archive_crawls, partition_jobs, CrawlingException, crawl
+from configs.database import get_database_cursor, create_indexes
+from configs.utils import get_absolute_tranco_file_path, iter_tranco_data, compute_tolerance_window, \
+    parse_archive_datetime, parse_archive_timestamp
+from data_collection.collect_archive_data import ArchiveJob, run_jobs as run_archive_jobs
+from data_collection.crawling import setup, reset_failed_archive_crawls, chunk_jobs, shuffle_jobs, RowBatcher, \
+    RateLimiter, init_worker, get_worker_cursor, get_worker_session, wait_for_rate_limit, CrawlingException, crawl, \
+    BATCH_SIZE
 
 CANDIDATES_WORKERS = 2
+CANDIDATES_CHUNK_SIZE = BATCH_SIZE
+CDX_REQUEST_RATE = CANDIDATES_WORKERS
 
 TABLE_NAME = 'HISTORICAL_DATA_NEIGHBORHOODS'
 CANDIDATES_TABLE_NAME = 'NEIGHBORHOOD_CANDIDATES'
 
+CANDIDATES_COLUMNS = ('tranco_id', 'domain', 'url', 'timestamp', 'candidates')
+CANDIDATES_ERROR_COLUMNS = ('tranco_id', 'domain', 'url', 'timestamp', 'error')
+
 CDX_REQUEST = 'https://web.archive.org/cdx/search/cdx' + \
-              '?url={url}&output=json&fl=timestamp&filter=!statuscode:3..&from={from_timestamp}&to={to_timestamp}'
+              '?url={url}&fl=timestamp&filter=!statuscode:3..&from={from_timestamp}&to={to_timestamp}'
 
 
 class CdxJob(NamedTuple):
@@ -51,18 +55,18 @@ def setup_candidates_table() -> None:
             );
         """)
 
-        for column in ['tranco_id', 'domain', 'url', 'timestamp', 'candidates', 'error']:
-            cursor.execute(f"""
-                CREATE INDEX IF NOT EXISTS {CANDIDATES_TABLE_NAME}_{column}_idx ON {CANDIDATES_TABLE_NAME} ({column})
-            """)
+    # `candidates` is only ever read, never searched, so it does not need an index
+    create_indexes(CANDIDATES_TABLE_NAME, ['tranco_id', 'domain', 'url', 'timestamp', 'error'])
 
 
 def reset_failed_cdx_crawls() -> dict[datetime, set[int]]:
     """Delete all crawling results with an error."""
     with get_database_cursor(autocommit=True) as cursor:
-        cursor.execute(f"DELETE FROM {CANDIDATES_TABLE_NAME} WHERE error IS NOT NULL")
-        cursor.execute(f"SELECT timestamp, ARRAY_AGG(tranco_id) FROM {CANDIDATES_TABLE_NAME} GROUP BY timestamp")
-        return defaultdict(set, ((timestamp, set(ids)) for timestamp, ids in cursor.fetchall()))
+        cursor.execute(f"""
+            DELETE FROM {CANDIDATES_TABLE_NAME} WHERE error IS NOT NULL;
+            SELECT timestamp, ARRAY_AGG(tranco_id) FROM {CANDIDATES_TABLE_NAME} GROUP BY timestamp;
+        """)
+        return defaultdict(set, {timestamp: set(ids) for timestamp, ids in cursor})
 
 
 def neighborhood_window_centers(timestamp: datetime) -> Generator[datetime, None, None]:
@@ -74,6 +78,26 @@ def neighborhood_window_centers(timestamp: datetime) -> Generator[datetime, None
         yield timestamp + timedelta(days=i)
 
 
+def nearest_captures(captures: list[int], base: int, left: int, right: int, n: int) -> list[int]:
+    """Select the `n` captures closest to `base` within [`left`, `right`] from the sorted list of `captures`.
+
+    Starting from the position of `base`, expand outwards and always take the closer neighbor (the earlier one on ties),
+    such that the result is ordered by distance to `base`.
+    """
+    lo, hi = bisect_left(captures, left), bisect_right(captures, right)
+    i = j = bisect_left(captures, base, lo, hi)
+    nearest = []
+    while len(nearest) < n and (lo < i or j < hi):
+        if j == hi or (lo < i and base - captures[i - 1] <= captures[j] - base):
+            i -= 1
+            nearest.append(captures[i])
+        else:
+            nearest.append(captures[j])
+            j += 1
+
+    return nearest
+
+
 def find_candidates(url: str,
                     timestamp: datetime,
                     n: int = 10,
@@ -94,50 +118,51 @@ def find_candidates(url: str,
         store_content=False
     )
 
-    try:
-        timestamps = response.json()
-    except JSONDecodeError as error:
-        raise CrawlingException(url) from error
+    # The plain-text output lists one timestamp per line, which is cheaper to transfer and parse than JSON
+    timestamps = response.text.split()
+    if response.status_code != 200 or not all(ts.isdigit() and len(ts) == 14 for ts in timestamps):
+        raise CrawlingException(url) from ValueError(f"Unexpected CDX response (status {response.status_code})")
 
     if not timestamps:
         return []
 
-    timestamps = set(chain.from_iterable(timestamps[1:]))
-    timestamps = [datetime.strptime(ts, INTERNET_ARCHIVE_TIMESTAMP_FORMAT).replace(tzinfo=UTC) for ts in timestamps]
+    # Compare captures as seconds since the epoch and map them back to their original timestamp strings in the end
+    captures = {parse_archive_timestamp(ts): ts for ts in timestamps}
+    sorted_captures = sorted(captures)
+    left_limit, right_limit = int(left_limit.timestamp()), int(right_limit.timestamp())
+    half_window = int(timedelta(days=3, hours=12).total_seconds())
 
     for base_timestamp in neighborhood_window_centers(timestamp):
-        left = max(left_limit, base_timestamp - timedelta(days=3, hours=12))
-        right = min(right_limit, base_timestamp + timedelta(days=3, hours=12))
-
-        def base_timestamp_distance(value: datetime) -> timedelta:
-            return abs(base_timestamp - value)
+        base = int(base_timestamp.timestamp())
+        left = max(left_limit, base - half_window)
+        right = min(right_limit, base + half_window)
 
-        new_candidates = nsmallest(n, [ts for ts in timestamps if left <= ts <= right], key=base_timestamp_distance)
+        new_candidates = nearest_captures(sorted_captures, base, left, right, n)
         candidates = max(candidates, new_candidates, key=len)
 
         if len(candidates) == n:
             break
 
-    return [candidate.strftime(INTERNET_ARCHIVE_TIMESTAMP_FORMAT) for candidate in candidates]
+    return [captures[candidate] for candidate in candidates]
 
 
 def cdx_worker(jobs: list[CdxJob]) -> None:
     """Crawl the CDX server for all provided `urls` and `timestamps` and store the responses in the database."""
-    session = requests.Session()
-    with get_database_cursor(autocommit=True) as cursor:
-        for timestamp, tranco_id, domain, url, proxies in jobs:
-            sleep(1)
-            try:
-                candidates = find_candidates(url, timestamp, 10, proxies, session)
-                cursor.execute(f"""
-                    INSERT INTO {CANDIDATES_TABLE_NAME} (tranco_id, domain, url, timestamp, candidates)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (tranco_id, domain, url, timestamp, Json(candidates)))
-            except CrawlingException as error:
-                cursor.execute(f"""
-                    INSERT INTO {CANDIDATES_TABLE_NAME} (tranco_id, domain, url, timestamp, error)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (tranco_id, domain, url, timestamp, error.to_json()))
+    with get_worker_cursor() as cursor:
+        session = get_worker_session()
+        batcher = RowBatcher(cursor, BATCH_SIZE)
+        try:
+            for timestamp, tranco_id, domain, url, proxies in jobs:
+                wait_for_rate_limit()
+                try:
+                    candidates = find_candidates(url, timestamp, 10, proxies, session)
+                    batcher.add(CANDIDATES_TABLE_NAME, CANDIDATES_COLUMNS,
+                                (tranco_id, domain, url, timestamp, Json(candidates)))
+                except CrawlingException as error:
+                    batcher.add(CANDIDATES_TABLE_NAME, CANDIDATES_ERROR_COLUMNS,
+                                (tranco_id, domain, url, timestamp, error.to_json()))
+        finally:
+            batcher.flush()
 
 
 def crawl_web_archive_cdx(tranco_file: Path = get_absolute_tranco_file_path(),
@@ -147,15 +172,16 @@ def crawl_web_archive_cdx(tranco_file: Path = get_absolute_tranco_file_path(),
     """Crawl the Internet Archive CDX server for candidates for each (url, timestamp) neighborhood."""
     worked_jobs = reset_failed_cdx_crawls()
 
-    jobs = [
+    jobs = (
         CdxJob(timestamp, tranco_id, domain, url, proxies)
-        for tranco_id, domain, url in get_tranco_data(tranco_file, n)
+        for tranco_id, domain, url in iter_tranco_data(tranco_file, n)
         for timestamp in timestamps
         if tranco_id not in worked_jobs[timestamp]
-    ]
+    )
 
-    with Pool(CANDIDATES_WORKERS) as pool:
-        pool.map(cdx_worker, partition_jobs(jobs, CANDIDATES_WORKERS))
+    with Pool(CANDIDATES_WORKERS, initializer=init_worker, initargs=(RateLimiter(CDX_REQUEST_RATE), False)) as pool:
+        for _ in pool.imap_unordered(cdx_worker, chunk_jobs(shuffle_jobs(jobs), CANDIDATES_CHUNK_SIZE)):
+            pass
 
 
 def crawl_neighborhoods(timestamps: list[datetime] = TIMESTAMPS,
@@ -163,27 +189,28 @@ def crawl_neighborhoods(timestamps: list[datetime] = TIMESTAMPS,
                         n: int = 10) -> None:
     """Crawl the Internet Archive for the `n` closest candidates of the neighborhood."""
     worked_jobs = reset_failed_archive_crawls(TABLE_NAME)
-    jobs = []
-    with get_database_cursor() as cursor:
-        for timestamp in timestamps:
-            cursor.execute(f"""
-                SELECT tranco_id, domain, url, candidates
-                FROM {CANDIDATES_TABLE_NAME}
-                WHERE timestamp=%s AND candidates!='[]'
-            """, (timestamp,))
-
-            jobs += [
-                ArchiveJob(ts, tid, domain, INTERNET_ARCHIVE_URL.format(timestamp=timestamp_str, url=url), proxies)
-                for tid, domain, url, candidates in cursor.fetchall()
-                for timestamp_str in candidates[:n]
-                if tid not in worked_jobs[
-                    ts := datetime.strptime(timestamp_str, INTERNET_ARCHIVE_TIMESTAMP_FORMAT).replace(tzinfo=UTC)
-                ]
-            ]
-
-    worker = partial(archive_worker, table_name=TABLE_NAME)
-    with Pool(WORKERS) as pool:
-        pool.map(worker, partition_jobs(jobs, WORKERS))
+
+    def iter_jobs() -> Generator[ArchiveJob, None, None]:
+        """Fetch the candidates per timestamp and yield the pending ArchiveJobs without building a list of all jobs.
+
+        The cursor is in autocommit mode, such that no transaction (and snapshot) is held open while the jobs are
+        consumed over the course of the crawl.
+        """
+        with get_database_cursor(autocommit=True) as cursor:
+            for timestamp in timestamps:
+                cursor.execute(f"""
+                    SELECT tranco_id, domain, url, candidates
+                    FROM {CANDIDATES_TABLE_NAME}
+                    WHERE timestamp=%s AND candidates!='[]'
+                """, (timestamp,))
+
+                for tid, domain, url, candidates in cursor.fetchall():
+                    for timestamp_str in candidates[:n]:
+                        if tid not in worked_jobs[ts := parse_archive_datetime(timestamp_str)]:
+                            yield ArchiveJob(ts, tid, domain,
+                                             INTERNET_ARCHIVE_URL.format(timestamp=timestamp_str, url=url), proxies)
+
+    run_archive_jobs(iter_jobs(), TABLE_NAME)
 
 
 def main():
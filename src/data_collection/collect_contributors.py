@@ -1,8 +1,7 @@
+from collections.abc import Iterable
 from multiprocessing import Pool
-from time import sleep
 from typing import NamedTuple
 
-import requests
 from psycopg2.extras import Json
 from requests import JSONDecodeError, Session
 
@@ -10,12 +9,18 @@ from configs.analysis import INTERNET_ARCHIVE_SOURCE_HEADER
 from configs.crawling import INTERNET_ARCHIVE_METADATA_API
 from configs.database import get_database_cursor
 from data_collection.collect_archive_neighborhoods import TABLE_NAME as NEIGHBORHOODS_TABLE_NAME
-from data_collection.crawling import partition_jobs, crawl, CrawlingException
+from data_collection.crawling import chunk_jobs, shuffle_jobs, RowBatcher, RateLimiter, init_worker, \
+    get_worker_cursor, get_worker_session, wait_for_rate_limit, crawl, CrawlingException, BATCH_SIZE
 
 WORKERS = 8
+CHUNK_SIZE = 4 * BATCH_SIZE
+REQUEST_RATE = 5 * WORKERS
 
 METADATA_TABLE_NAME = 'HISTORICAL_DATA_METADATA'
 
+METADATA_COLUMNS = ('source', 'raw_data', 'metadata', 'contributor')
+METADATA_ERROR_COLUMNS = ('source', 'error')
+
 
 class MetadataJob(NamedTuple):
     """Represents a job for crawling the IA metadata API and storing data in the database."""
@@ -72,30 +77,29 @@ def crawl_metadata(source: str,
 
 
 def worker(jobs: list[MetadataJob], table_name=METADATA_TABLE_NAME) -> None:
-    """Crawl all provided `urls` and store the responses in the database."""
-    with get_database_cursor(autocommit=True) as cursor:
-        session = requests.Session()
-        for source, proxies in jobs:
-            sleep(0.2)
-            try:
-                cursor.execute(f"""
-                    INSERT INTO {table_name}
-                    (source, raw_data, metadata, contributor)
-                    VALUES (%s, %s, %s, %s)
-                """, (source, *crawl_metadata(source, proxies=proxies, session=session)))
-            except CrawlingException as error:
-                cursor.execute(f"""
-                    INSERT INTO {table_name}
-                    (source, error)
-                    VALUES (%s, %s)
-                """, (source, error.to_json()))
+    """Crawl all provided `urls` and store the responses in the database, committing once per `BATCH_SIZE` jobs."""
+    with get_worker_cursor() as cursor:
+        session = get_worker_session()
+        batcher = RowBatcher(cursor, BATCH_SIZE)
+        try:
+            for source, proxies in jobs:
+                wait_for_rate_limit()
+                try:
+                    batcher.add(table_name, METADATA_COLUMNS,
+                                (source, *crawl_metadata(source, proxies=proxies, session=session)))
+                except CrawlingException as error:
+                    batcher.add(table_name, METADATA_ERROR_COLUMNS, (source, error.to_json()))
+        finally:
+            batcher.flush()
 
 
 def reset_failed_metadata_crawls() -> set[str]:
     """Delete all crawling results with an error."""
     with get_database_cursor(autocommit=True) as cursor:
-        cursor.execute(f"DELETE FROM {METADATA_TABLE_NAME} WHERE error IS NOT NULL")
-        cursor.execute(f"SELECT DISTINCT source FROM {METADATA_TABLE_NAME}")
+        cursor.execute(f"""
+            DELETE FROM {METADATA_TABLE_NAME} WHERE error IS NOT NULL;
+            SELECT DISTINCT source FROM {METADATA_TABLE_NAME};
+        """)
         return {source for source, in cursor.fetchall()}
 
 
@@ -105,10 +109,11 @@ def prepare_jobs(sources: list[str], proxies: dict[str, str] | None = None) -> l
     return [MetadataJob(source, proxies) for source in sources if source not in worked_jobs]
 
 
-def run_jobs(jobs: list[MetadataJob]) -> None:
-    """Execute the provided crawl jobs using multiprocessing."""
-    with Pool(WORKERS) as pool:
-        pool.map(worker, partition_jobs(jobs, WORKERS))
+def run_jobs(jobs: Iterable[MetadataJob]) -> None:
+    """Execute the provided crawl jobs using multiprocessing, dispatching them in chunks of `CHUNK_SIZE` jobs."""
+    with Pool(WORKERS, initializer=init_worker, initargs=(RateLimiter(REQUEST_RATE, WORKERS), False)) as pool:
+        for _ in pool.imap_unordered(worker, chunk_jobs(shuffle_jobs(jobs), CHUNK_SIZE)):
+            pass
 
 
 def main():
@@ -1,14 +1,17 @@
-from datetime import date as date_type
+from collections.abc import Iterable, Iterator
+from datetime import timedelta, date as date_type
 from multiprocessing import Pool
 from pathlib import Path
 from typing import NamedTuple
 
 from configs.crawling import NUMBER_URLS, TODAY
 from configs.database import get_database_cursor
-from configs.utils import get_absolute_tranco_file_path, get_tranco_data
-from data_collection.crawling import setup, partition_jobs, CrawlingException, crawl
+from configs.utils import get_absolute_tranco_file_path, iter_tranco_data
+from data_collection.crawling import setup, chunk_jobs, shuffle_jobs, RowBatcher, init_worker, get_worker_cursor, \
+    get_worker_session, CrawlingException, crawl, BATCH_SIZE, RESPONSE_COLUMNS, ERROR_COLUMNS
 
 WORKERS = 8
+CHUNK_SIZE = 4 * BATCH_SIZE
 
 TABLE_NAME = 'LIVE_DATA'
 
@@ -21,45 +24,48 @@ class LiveJob(NamedTuple):
 
 
 def worker(jobs: list[LiveJob], table_name: str = TABLE_NAME) -> None:
-    """Crawl all provided `urls` and store the responses in the database."""
-    with get_database_cursor(autocommit=True) as cursor:
-        for tranco_id, domain, url in jobs:
-            try:
-                response = crawl(url)
-                cursor.execute(f"""
-                    INSERT INTO {table_name}
-                    (tranco_id, domain, timestamp, start_url, end_url, status_code, headers, content_hash, response_time)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (tranco_id, domain, TODAY, url, *response.serialized_data))
-            except CrawlingException as error:
-                cursor.execute(f"""
-                    INSERT INTO {table_name}
-                    (tranco_id, domain, timestamp, start_url, headers)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (tranco_id, domain, TODAY, url, error.to_json()))
+    """Crawl all provided `urls` and store the responses in the database, committing once per `BATCH_SIZE` jobs."""
+    with get_worker_cursor() as cursor:
+        batcher = RowBatcher(cursor, BATCH_SIZE)
+        try:
+            for tranco_id, domain, url in jobs:
+                try:
+                    response = crawl(url, session=get_worker_session(fresh_cookies=True))
+                    batcher.add(table_name, RESPONSE_COLUMNS,
+                                (tranco_id, domain, TODAY, url, *response.serialized_data))
+                except CrawlingException as error:
+                    batcher.add(table_name, ERROR_COLUMNS, (tranco_id, domain, TODAY, url, error.to_json()))
+        finally:
+            batcher.flush()
 
 
 def reset_failed_crawls(table_name: str, date: date_type = TODAY.date()) -> set[int]:
     """Delete all crawling results whose status code is 429 or NULL and return the affected tranco ids."""
     with get_database_cursor(autocommit=True) as cursor:
         cursor.execute(f"""
-            DELETE FROM {table_name} WHERE crawl_datetime::date=%s AND (status_code!=200 OR status_code IS NULL)
-        """, (date,))
+            DELETE FROM {table_name}
+            WHERE crawl_datetime>=%s AND crawl_datetime<%s AND (status_code!=200 OR status_code IS NULL);
 
-        cursor.execute(f"SELECT DISTINCT tranco_id FROM {table_name} WHERE crawl_datetime::date=%s", (date,))
+            SELECT DISTINCT tranco_id FROM {table_name} WHERE crawl_datetime>=%s AND crawl_datetime<%s;
+        """, (date, date + timedelta(days=1), date, date + timedelta(days=1)))
         return {tid for tid, in cursor.fetchall()}
 
 
-def prepare_jobs(tranco_file: Path = get_absolute_tranco_file_path(), n: int = NUMBER_URLS) -> list[LiveJob]:
-    """Build a list of LiveJob instances for the given Tranco file and maximum number of domains."""
+def prepare_jobs(tranco_file: Path = get_absolute_tranco_file_path(), n: int = NUMBER_URLS) -> Iterator[LiveJob]:
+    """Lazily generate LiveJob instances for the given Tranco file and maximum number of domains."""
     worked_jobs = reset_failed_crawls(TABLE_NAME)
-    return [LiveJob(tid, domain, url) for tid, domain, url in get_tranco_data(tranco_file, n) if tid not in worked_jobs]
-
-
-def run_jobs(jobs: list[LiveJob]) -> None:
-    """Execute the provided crawl jobs using multiprocessing."""
-    with Pool(WORKERS) as pool:
-        pool.map(worker, partition_jobs(jobs, WORKERS))
+    return (
+        LiveJob(tid, domain, url)
+        for tid, domain, url in iter_tranco_data(tranco_file, n)
+        if tid not in worked_jobs
+    )
+
+
+def run_jobs(jobs: Iterable[LiveJob]) -> None:
+    """Execute the provided crawl jobs using multiprocessing, dispatching them in chunks of `CHUNK_SIZE` jobs."""
+    with Pool(WORKERS, initializer=init_worker) as pool:
+        for _ in pool.imap_unordered(worker, chunk_jobs(shuffle_jobs(jobs), CHUNK_SIZE)):
+            pass
 
 
 def main():
@@ -4,22 +4,46 @@ import re
 import signal
 import traceback
 from collections import defaultdict
-from collections.abc import Generator
+from collections.abc import Generator, Iterable
 from contextlib import contextmanager
-from datetime import datetime, date as date_type
+from datetime import datetime, timedelta, date as date_type
 from hashlib import sha256
-from itertools import cycle
-from time import time_ns, sleep
+from io import StringIO
+from itertools import islice
+from multiprocessing import Array
+from os import getpid
+from pathlib import Path
+from time import time_ns, sleep, monotonic
 from types import FrameType
+from typing import Any
 
-from psycopg2.extras import Json
+import orjson
+from psycopg2 import DatabaseError
+from psycopg2.extensions import connection as connection_type, cursor as cursor_type
+from psycopg2.extras import Json, execute_values
 from requests import Session, Response, ConnectionError, RequestException
+from requests.adapters import HTTPAdapter
 from tldextract import extract
 
 from configs.analysis import MEMENTO_HEADER
 from configs.crawling import USER_AGENT, TODAY, WAYBACK_API_REGEX, WAYBACK_HEADER_REGEX, WAYBACK_TOOLBAR_REGEX, \
     WAYBACK_COMMENT_REGEX, WAYBACK_SOURCE_REGEX, WAYBACK_RELATIVE_SOURCE_REGEX, WAYBACK_PATH_RELATIVE_SOURCE_REGEX
-from configs.database import STORAGE, get_database_cursor
+from configs.database import STORAGE, get_database_connection, get_database_cursor, create_indexes
+
+BATCH_SIZE = 50
+POOL_SIZE = 32
+RATE_LIMIT_RETRIES = 2
+REQUEST_TIMEOUT = 20
+HARD_TIMEOUT = 30
+COMPRESSION_LEVEL = 6
+
+RESPONSE_COLUMNS = (
+    'tranco_id', 'domain', 'timestamp', 'start_url',
+    'end_url', 'status_code', 'headers', 'content_hash', 'response_time'
+)
+ERROR_COLUMNS = ('tranco_id', 'domain', 'timestamp', 'start_url', 'headers')
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
 
 
 def setup(table_name: str) -> None:
@@ -41,34 +65,225 @@ def setup(table_name: str) -> None:
             );
         """)
 
-        for column in ['tranco_id', 'domain', 'timestamp', 'start_url', 'end_url', 'status_code', 'content_hash',
-                       'response_time', 'crawl_datetime']:
-            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_{column}_idx ON {table_name} ({column})")
+    create_indexes(table_name, ['tranco_id', 'domain', 'timestamp', 'start_url', 'end_url', 'status_code',
+                                'content_hash', 'response_time', 'crawl_datetime'])
 
 
 def reset_failed_archive_crawls(table_name: str, date: date_type = TODAY.date()) -> dict[datetime, set[int]]:
     """Delete all crawling results that are missing the memento header, except for responses with status code 404."""
     with get_database_cursor(autocommit=True) as cursor:
+        # Send both statements at once to save a round trip; `fetchall` returns the result of the last one
+        # Compare `crawl_datetime` against the day's bounds (instead of casting it) so the column's index can be used
         cursor.execute(f"""
             DELETE FROM {table_name}
-            WHERE crawl_datetime::date=%s AND (status_code IS NULL OR headers->>%s IS NULL AND status_code!=404)
-        """, (date, MEMENTO_HEADER.lower()))
+            WHERE crawl_datetime>=%s AND crawl_datetime<%s
+              AND (status_code IS NULL OR headers->>%s IS NULL AND status_code!=404);
 
-        cursor.execute(f"""
-            SELECT timestamp, ARRAY_AGG(tranco_id) FROM {table_name} WHERE crawl_datetime::date=%s GROUP BY timestamp
-        """, (date,))
-        return defaultdict(set, ((timestamp, set(ids)) for timestamp, ids in cursor.fetchall()))
+            SELECT timestamp, ARRAY_AGG(tranco_id)
+            FROM {table_name}
+            WHERE crawl_datetime>=%s AND crawl_datetime<%s
+            GROUP BY timestamp;
+        """, (date, date + timedelta(days=1), MEMENTO_HEADER.lower(), date, date + timedelta(days=1)))
+        return defaultdict(set, {timestamp: set(ids) for timestamp, ids in cursor})
+
+
+def insert_rows(cursor: cursor_type, table_name: str, columns: tuple[str, ...], rows: list[tuple]) -> None:
+    """Insert all buffered `rows` into `table_name` within the current transaction and clear the buffer afterward.
+
+    The batch is guarded by a savepoint: if it is rejected by the database, the rows are retried one by one (each behind
+    its own savepoint), such that a single malformed row neither discards the whole batch nor aborts the transaction.
+    Committing is left to the caller.
+    """
+    if not rows:
+        return
+
+    query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s"
+    cursor.execute("SAVEPOINT insert_rows")
+    try:
+        execute_values(cursor, query, rows, page_size=len(rows))
+    except DatabaseError:
+        cursor.execute("ROLLBACK TO SAVEPOINT insert_rows")
+        for row in rows:
+            try:
+                execute_values(cursor, query, [row])
+                cursor.execute("RELEASE SAVEPOINT insert_rows")
+                cursor.execute("SAVEPOINT insert_rows")
+            except DatabaseError as error:
+                cursor.execute("ROLLBACK TO SAVEPOINT insert_rows")
+                print('WARNING: INSERT FAILED', row[:4], error)
+    cursor.execute("RELEASE SAVEPOINT insert_rows")
+    rows.clear()
+
+
+def format_copy_value(value: Any) -> str:
+    """Render `value` as a field of PostgreSQL's text `COPY` format."""
+    if value is None:
+        return r'\N'
+    if isinstance(value, Json):
+        # JSONB does not preserve formatting, so the faster orjson serialization yields the same stored value
+        try:
+            value = orjson.dumps(value.adapted).decode()
+        except orjson.JSONEncodeError:
+            # orjson rejects e.g. integers beyond 64 bit, lone surrogates, and non-str keys; use Json's own serializer
+            value = value.dumps(value.adapted)
+    return str(value).translate(COPY_ESCAPES)
+
+
+def copy_rows(cursor: cursor_type, table_name: str, columns: tuple[str, ...], rows: list[tuple]) -> None:
+    """Load all buffered `rows` into `table_name` via `COPY` within the current transaction and clear the buffer.
+
+    If the database rejects the data, fall back to `insert_rows` to salvage all valid rows.
+    """
+    if not rows:
+        return
+
+    data = StringIO(''.join('\t'.join(map(format_copy_value, row)) + '\n' for row in rows))
+    cursor.execute("SAVEPOINT copy_rows")
+    try:
+        cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN", data)
+    except DatabaseError:
+        cursor.execute("ROLLBACK TO SAVEPOINT copy_rows")
+        insert_rows(cursor, table_name, columns, rows)
+    cursor.execute("RELEASE SAVEPOINT copy_rows")
+    rows.clear()
+
+
+class RowBatcher:
+    """Buffer rows for one or more (table, columns) targets and insert them in a single transaction per batch."""
+
+    def __init__(self, cursor: cursor_type, size: int = BATCH_SIZE):
+        self.cursor = cursor
+        self.size = size
+        self.rows = defaultdict(list)
+        self.pending = 0
+
+    def add(self, table_name: str, columns: tuple[str, ...], row: tuple) -> None:
+        """Buffer `row` and flush all buffers once `size` rows are pending."""
+        self.rows[table_name, columns].append(row)
+        self.pending += 1
+        if self.pending >= self.size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Load all pending rows and commit them at once."""
+        for (table_name, columns), rows in self.rows.items():
+            copy_rows(self.cursor, table_name, columns, rows)
+        self.cursor.connection.commit()
+        self.pending = 0
 
 
 def partition_jobs(jobs: list, n: int) -> list[list]:
     """Partition list of jobs into `n` partitions of (almost) equal size."""
-    partition = [[] for _ in range(n)]
+    # shuffle a copy, such that the caller's list is left untouched
+    jobs = random.sample(jobs, len(jobs))
+    return [jobs[i::n] for i in range(n)]
+
 
+def shuffle_jobs(jobs: Iterable) -> list:
+    """Return all `jobs` in random order, such that crawls do not visit the domains ordered by their rank."""
+    jobs = list(jobs)
     random.shuffle(jobs)
-    for i, job in zip(cycle(range(n)), jobs):
-        partition[i].append(job)
+    return jobs
+
+
+def chunk_jobs(jobs: Iterable, size: int) -> Generator[list, None, None]:
+    """Lazily split the (possibly unbounded) iterable of jobs into lists of at most `size` jobs."""
+    jobs = iter(jobs)
+    while chunk := list(islice(jobs, size)):
+        yield chunk
+
+
+class RateLimiter:
+    """Token bucket that permits `rate` requests per second on average and bursts of up to `capacity` requests.
+
+    The bucket lives in shared memory, so all worker processes forked after its creation draw from the same bucket and
+    jointly adhere to the rate. Time spent waiting for responses refills the bucket, so callers only block if they are
+    actually faster than the permitted rate.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        # [available tokens, time of the last update]
+        self.state = Array('d', [capacity, monotonic()])
+
+    def wait(self) -> None:
+        """Take a token and block until it is actually available."""
+        with self.state.get_lock():
+            now = monotonic()
+            tokens, updated = self.state
+            # Tokens may become negative, which reserves the upcoming tokens for the processes that are already waiting
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate) - 1
+            self.state[:] = [tokens, now]
+        if tokens < 0:
+            sleep(-tokens / self.rate)
+
+
+def make_session(pool_size: int = POOL_SIZE) -> Session:
+    """Create a session that keeps connections to up to `pool_size` hosts alive across requests.
+
+    Failed requests are deliberately not retried by the adapter: the Wayback Machine replays archived error responses
+    (including 429s), and refused connections are handled as rate-limiting in `crawl`.
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
-    return partition
+# Process-local resources of pool workers, reused by all tasks (i.e., chunks of jobs) a worker process executes
+_worker_connection: connection_type | None = None
+_worker_session: Session | None = None
+_worker_rate_limiter: RateLimiter | None = None
+_worker_synchronous_commit: bool = True
+
+
+def init_worker(rate_limiter: RateLimiter | None = None, synchronous_commit: bool = True) -> None:
+    """Install the pool-wide `rate_limiter` and `synchronous_commit` setting in the current (pool) process."""
+    global _worker_rate_limiter, _worker_synchronous_commit
+    _worker_rate_limiter = rate_limiter
+    _worker_synchronous_commit = synchronous_commit
+
+
+def _connect_worker_db() -> None:
+    """(Re-)open the database connection of the current process, leaving its session and rate limiter untouched."""
+    global _worker_connection
+    _worker_connection = get_database_connection(autocommit=True)
+    if not _worker_synchronous_commit:
+        # a server crash may lose the latest batches, so only for crawls that re-crawl missing results regardless of day
+        with _worker_connection.cursor() as cursor:
+            cursor.execute("SET synchronous_commit TO OFF")
+    _worker_connection.autocommit = False
+
+
+@contextmanager
+def get_worker_cursor() -> Generator[cursor_type, None, None]:
+    """Yield a cursor on the database connection of the current process, rolling back on errors."""
+    if _worker_connection is None or _worker_connection.closed:
+        _connect_worker_db()
+    with _worker_connection, _worker_connection.cursor() as cursor:
+        yield cursor
+
+
+def get_worker_session(fresh_cookies: bool = False) -> Session:
+    """Return the (pooled, keep-alive) HTTP session of the current process, creating it on first use.
+
+    With `fresh_cookies`, the session's cookies are cleared, such that it behaves like a fresh session (without cookies
+    set by previously crawled domains) while still reusing its pooled connections.
+    """
+    global _worker_session
+    if _worker_session is None:
+        _worker_session = make_session()
+    if fresh_cookies:
+        _worker_session.cookies.clear()
+    return _worker_session
+
+
+def wait_for_rate_limit() -> None:
+    """Block until the rate limiter of the current process (if any) permits the next request."""
+    if _worker_rate_limiter is not None:
+        _worker_rate_limiter.wait()
 
 
 @contextmanager
@@ -99,13 +314,31 @@ def normalize_archived_content(content: bytes) -> bytes:
     return re.sub(WAYBACK_RELATIVE_SOURCE_REGEX, rb'\1', content)
 
 
+# storage directories known to exist (at most 16 * 16 two-level prefixes)
+_storage_directories: set[Path] = set()
+
+
 def store_on_disk(content: bytes) -> str:
     """Store the provided content on the disk and compute the content hash."""
     content_hash = sha256(content).hexdigest()
     file_path = STORAGE.joinpath(content_hash[0], content_hash[1], f"{content_hash}.gz")
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with gzip.open(file_path, 'wb') as fh:
-        fh.write(content)
+    if file_path.exists():
+        # content-addressed storage: identical content has already been stored
+        return content_hash
+
+    if file_path.parent not in _storage_directories:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        _storage_directories.add(file_path.parent)
+    # write into a process-private file first and publish it atomically, such that no partial files are ever visible
+    tmp_path = file_path.with_name(f"{file_path.name}.{getpid()}.tmp")
+    try:
+        with gzip.open(tmp_path, 'wb', compresslevel=COMPRESSION_LEVEL) as fh:
+            fh.write(content)
+        tmp_path.replace(file_path)
+    except BaseException:
+        # never leave orphaned temporary files behind in the content store
+        tmp_path.unlink(missing_ok=True)
+        raise
 
     return content_hash
 
@@ -137,35 +370,49 @@ class CrawlingResponse(Response):
         return self.url, self.status_code, Json(dict(self.headers)), self.content_hash, self.response_time
 
 
+def get_retry_delay(response: Response, max_delay: int = 60) -> int:
+    """Return the number of seconds to wait as requested by the `Retry-After` header, capped at `max_delay`."""
+    retry_after = response.headers.get('Retry-After', '')
+    return min(int(retry_after), max_delay) if retry_after.isdigit() else max_delay
+
+
 def crawl(url: str,
           headers: dict[str, str] | None = None,
           user_agent: str = USER_AGENT,
           proxies: dict[str, str] | None = None,
           session: Session | None = None,
           store_content: bool = True) -> CrawlingResponse:
-    """Crawl the URL, using the provided `headers`, `user_agent`, `session` (if specified).
+    """Crawl the URL, using the provided `headers`, `user_agent`, `session` (default: the session of the process).
 
-    Return the response object and its hashed content. Raise a CrawlingException on failure.
+    Rate-limited requests (429 without memento header) are retried up to `RATE_LIMIT_RETRIES` times after waiting as
+    requested by the server. Return the response object and its hashed content. Raise a CrawlingException on failure.
     """
     if session is None:
-        session = Session()
+        session = get_worker_session(fresh_cookies=True)
     if headers is None:
         headers = dict()
     headers['User-Agent'] = user_agent
 
-    try:
-        with timeout(30):
-            start = time_ns()
-            response = session.get(url, headers=headers, proxies=proxies, timeout=20)
-            response_time = time_ns() - start
-    except ConnectionError as error:
-        if (extract(url).registered_domain == 'archive.org' and
-                ('Connection refused' in str(error) or 'Connection closed unexpectedly' in str(error))):
-            print('WARNING: RATE-LIMITING - ConnectionError', error)
-            sleep(60)
-        raise CrawlingException(url) from error
-    except (RequestException, TimeoutError) as error:
-        raise CrawlingException(url) from error
+    for _ in range(1 + RATE_LIMIT_RETRIES):
+        try:
+            with timeout(HARD_TIMEOUT):
+                start = time_ns()
+                response = session.get(url, headers=headers, proxies=proxies, timeout=REQUEST_TIMEOUT)
+                response_time = time_ns() - start
+        except ConnectionError as error:
+            if (extract(url).registered_domain == 'archive.org' and
+                    ('Connection refused' in str(error) or 'Connection closed unexpectedly' in str(error))):
+                print('WARNING: RATE-LIMITING - ConnectionError', error)
+                sleep(60)
+            raise CrawlingException(url) from error
+        except (RequestException, TimeoutError) as error:
+            raise CrawlingException(url) from error
+
+        # mitigate rate-limiting (archived 429 responses carry a memento header and are valid results)
+        if response.status_code != 429 or MEMENTO_HEADER in response.headers:
+            break
+        print('WARNING: RATE-LIMITING - 429')
+        sleep(get_retry_delay(response))
 
     # store content on disk
     if store_content:
@@ -174,9 +421,4 @@ def crawl(url: str,
     else:
         content_hash = None
 
-    # mitigate rate-limiting
-    if response.status_code == 429 and MEMENTO_HEADER not in response.headers:
-        print('WARNING: RATE-LIMITING - 429')
-        sleep(60)
-
     return CrawlingResponse(response, content_hash, response_time)
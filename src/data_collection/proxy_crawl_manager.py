@@ -1,7 +1,7 @@
 from argparse import ArgumentParser, Namespace as Arguments
 from datetime import datetime, UTC
 from multiprocessing import Process, pool, get_context
-from subprocess import run
+from subprocess import Popen
 
 from requests import get
 
@@ -52,16 +52,22 @@ def build_socks_proxy_configs() -> list[dict[str, str] | None]:
                  https=f"socks5://localhost:{port}") for port in SOCKS_PROXIES] + [None]
 
 
+def run_in_parallel(commands: list[list[str]]) -> None:
+    """Start all `commands` at once and wait for all of them to finish."""
+    for process in [Popen(command) for command in commands]:
+        process.wait()
+
+
 def open_socks_proxies() -> None:
     """Open the socks proxies in the background."""
-    for port, remote in SOCKS_PROXIES.items():
-        run(['ssh', '-fnN', '-M', '-S', port, '-D', port, '-i', '~/.ssh/Proxies', remote])
+    run_in_parallel([['ssh', '-fnN', '-M', '-S', port, '-D', port, '-i', '~/.ssh/Proxies', remote]
+                     for port, remote in SOCKS_PROXIES.items()])
 
 
 def close_socks_proxies() -> None:
     """Close the open socks proxies in the background."""
-    for port, remote in SOCKS_PROXIES.items():
-        run(['ssh', '-S', port, '-O', 'exit', '-i', '~/.ssh/Proxies', remote])
+    run_in_parallel([['ssh', '-S', port, '-O', 'exit', '-i', '~/.ssh/Proxies', remote]
+                     for port, remote in SOCKS_PROXIES.items()])
 
 
 def test_socks_proxies() -> None: